@@ -9,18 +9,33 @@ Hotel Tech Stacker GPT - API Orchestrator
 
 from __future__ import annotations
 
-import json
+import copy
+import hashlib
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import date
+from itertools import islice
+from operator import attrgetter
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple, List
+from typing import Any, Callable, Dict, Optional, Tuple, List
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 
+import fastjsonschema
+import jiter
 from jsonschema import Draft202012Validator
+from jsonschema.exceptions import SchemaError
 
 from scoring import compute_grades
 from interpretation import build_gap_register, build_recommendations
 from priorities import build_next_steps
+from constants import CATEGORIES, CATEGORY_LABELS
 from report import (
     build_stack_register_rows,
     build_integration_map_rows,
@@ -33,77 +48,168 @@ SCHEMAS_DIR = Path(__file__).parent / "schemas"
 INTAKE_SCHEMA_PATH = SCHEMAS_DIR / "stack_intake.schema.json"
 OUTPUT_SCHEMA_PATH = SCHEMAS_DIR / "report_output.schema.json"
 
-app = FastAPI(title="Hotel Tech Stacker", version="2.0.0")
+# Output-schema validation is a self-check on deterministic in-process builders, not on user input.
+# Enable it in CI and debugging with HTS_VALIDATE_OUTPUT=1; production skips it per request.
+VALIDATE_OUTPUT = os.environ.get("HTS_VALIDATE_OUTPUT") == "1"
+
+logger = logging.getLogger("hotel_tech_stacker")
+
+app = FastAPI(title="Hotel Tech Stacker", version="2.0.0", default_response_class=ORJSONResponse)
 
 
 def _load_schema(path: Path) -> Dict[str, Any]:
-    if not path.exists():
+    # Bytes straight into orjson: no exists() probe, no intermediate str decode
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError as e:
         raise FileNotFoundError(
             f"Schema not found: {path}. Create schemas/stack_intake.schema.json and schemas/report_output.schema.json"
-        )
-    return json.loads(path.read_text(encoding="utf-8"))
+        ) from e
+    schema = orjson.loads(raw)
+
+    # Meta-validate at process start so schema bugs surface here, not on the first user request
+    try:
+        Draft202012Validator.check_schema(schema)
+    except SchemaError as e:
+        raise RuntimeError(f"Invalid schema {path}: {e.message}") from e
+    return schema
 
 
 INTAKE_SCHEMA = _load_schema(INTAKE_SCHEMA_PATH)
 OUTPUT_SCHEMA = _load_schema(OUTPUT_SCHEMA_PATH)
 
-INTAKE_VALIDATOR = Draft202012Validator(INTAKE_SCHEMA)
-OUTPUT_VALIDATOR = Draft202012Validator(OUTPUT_SCHEMA)
+# Format keywords are intentionally not enforced (no regex checkers per value).
+# The only one in use is report_output's meta.report_date ("format": "date"), which is
+# stamped by our own builder rather than supplied by the hotel, so it needs no runtime check.
+
+# Compiled once at import; used as the fast accept/reject check on every request.
+# fastjsonschema has no draft 2020-12 support and applies draft-07 rules to these schemas, so they
+# must stay within keywords both drafts interpret the same way (no prefixItems, $dynamicRef,
+# unevaluated*, dependentSchemas, ...); otherwise the fast path and the error pass can disagree.
+# compile() rewrites every $ref in the dict it is given, so it gets a copy and the module-level
+# schemas stay exactly as loaded from disk.
+INTAKE_VALIDATE = fastjsonschema.compile(copy.deepcopy(INTAKE_SCHEMA), use_formats=False)
+OUTPUT_VALIDATE = fastjsonschema.compile(copy.deepcopy(OUTPUT_SCHEMA), use_formats=False)
+
+# Only used to aggregate detailed errors once the fast path has rejected a payload.
+INTAKE_VALIDATOR = Draft202012Validator(INTAKE_SCHEMA, format_checker=None)
+OUTPUT_VALIDATOR = Draft202012Validator(OUTPUT_SCHEMA, format_checker=None)
+
+if not VALIDATE_OUTPUT:
+    logger.warning(
+        "Report output schema validation is disabled",
+        extra={"setting": "HTS_VALIDATE_OUTPUT", "value": os.environ.get("HTS_VALIDATE_OUTPUT", "")},
+    )
 
 
-def _validate_with(validator: Draft202012Validator, payload: Dict[str, Any]) -> List[Dict[str, str]]:
-    errors = []
-    for e in sorted(validator.iter_errors(payload), key=lambda x: x.path):
-        loc = ".".join([str(p) for p in e.path]) if e.path else "(root)"
-        errors.append({"location": loc, "message": e.message})
-    return errors
+# Rendered response bodies keyed by _report_cache_key, each stored with the report_date it was
+# stamped with; shared across worker threads
+_REPORT_CACHE_SIZE = 256
+_REPORT_CACHE: "OrderedDict[bytes, Tuple[str, bytes]]" = OrderedDict()
+_REPORT_CACHE_LOCK = threading.Lock()
 
+_ERROR_PATH = attrgetter("path")
+_DEFAULT_MAX_ERRORS = 25
 
-def _canonical_system_categories() -> List[str]:
-    return [
-        "pms",
-        "booking_engine",
-        "channel_manager_crs",
-        "rms",
-        "crm_guest_db",
-        "email_lifecycle",
-        "in_stay_tools",
-        "housekeeping_maintenance",
-        "finance_accounting",
-        "reporting_bi",
-    ]
 
+def _max_errors_from_env() -> int:
+    raw = os.environ.get("HTS_MAX_VALIDATION_ERRORS", "")
+    if not raw:
+        return _DEFAULT_MAX_ERRORS
+    try:
+        value = int(raw)
+    except ValueError:
+        logger.warning(
+            "Ignoring non-integer validation error cap",
+            extra={"setting": "HTS_MAX_VALIDATION_ERRORS", "value": raw},
+        )
+        return _DEFAULT_MAX_ERRORS
+    # islice rejects negative stops; at least one error is always reported
+    return max(1, value)
+
+
+# Upper bound on errors collected per payload; bounds 422 latency for pathological inputs
+_MAX_ERRORS = _max_errors_from_env()
+
+
+def _validate_with(
+    fast_validate: Callable[[Any], Any],
+    validator: Draft202012Validator,
+    payload: Dict[str, Any],
+) -> Dict[str, str]:
+    # Happy path: compiled validator, no error tree built
+    try:
+        fast_validate(payload)
+        return {}
+    except fastjsonschema.JsonSchemaException as exc:
+        rejection = exc
+
+    # Rejected: stop collecting after _MAX_ERRORS (+1 to detect that the cap was hit)
+    found = list(islice(validator.iter_errors(payload), _MAX_ERRORS + 1))
+    if not found:
+        # The two validators disagreed; the rejection stands (fail closed), reported as fastjsonschema saw it.
+        # Its path starts with the "data" root name, which is dropped to match the jsonschema locations.
+        path = getattr(rejection, "path", None) or ["data"]
+        return {".".join(map(str, path[1:])) or "(root)": getattr(rejection, "message", str(rejection))}
+    truncated = len(found) > _MAX_ERRORS
+
+    # One flat {location: message} map; repeated locations get "#2", "#3", ... suffixes
+    errors: Dict[str, str] = {}
+    for e in sorted(found[:_MAX_ERRORS], key=_ERROR_PATH):
+        loc = ".".join(map(str, e.path)) or "(root)"
+        key, n = loc, 1
+        while key in errors:
+            n += 1
+            key = f"{loc}#{n}"
+        errors[key] = e.message
+    if truncated:
+        errors["(truncated)"] = f"Validation stopped after {_MAX_ERRORS} errors; more may exist."
+    return errors
 
-def _extract_system(payload: Dict[str, Any], key: str) -> Dict[str, Any]:
-    """Return a normalized system entry for single or multi categories."""
-    entry = payload["stack"][key]
-
-    # Multi entries have {"systems": [...]}
-    if isinstance(entry, dict) and "systems" in entry:
-        return entry
 
-    # Single entries are already systemEntry shape
-    return {"systems": [entry]}
+_NOT_PROVIDED = sys.intern("not_provided")
+
+
+def _normalize_stack(payload: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Rewrite payload['stack'] in place so every category is {"systems": [...]} (runs once, after validation).
+    Returns an evidence index: category -> evidence levels of its systems, collected in the same pass.
+    Enum-valued strings (evidence_level, ownership) are interned as they are visited.
+    """
+    stack = payload["stack"]
+    evidence_index: Dict[str, List[str]] = {}
+    for cat, entry in stack.items():
+        # Single entries are systemEntry shape; multi entries already have {"systems": [...]}
+        if "systems" not in entry:
+            entry = stack[cat] = {"systems": [entry]}
+        levels: List[str] = []
+        for s in entry["systems"]:
+            # Enum values arrive as fresh strs from the parser; intern so later compares are identity checks
+            level = s["evidence_level"] = sys.intern(s["evidence_level"])
+            s["ownership"] = sys.intern(s["ownership"])
+            levels.append(level)
+        evidence_index[cat] = levels
+    return evidence_index
+
+
+def _missing_categories(evidence_index: Dict[str, List[str]]) -> List[str]:
+    # A category whose entries are all not_provided is missing (canonical order for follow-ups)
+    missing: List[str] = []
+    for cat in CATEGORIES:
+        for level in evidence_index[cat]:
+            if level != _NOT_PROVIDED:
+                break
+        else:
+            missing.append(cat)
+    return missing
 
 
 def _build_minimum_followups(missing: List[str], unknown_links: List[Dict[str, str]]) -> List[str]:
     qs: List[str] = []
     if missing:
-        labels = {
-            "pms": "PMS",
-            "booking_engine": "Booking engine",
-            "channel_manager_crs": "Channel manager / CRS",
-            "rms": "RMS",
-            "crm_guest_db": "CRM / guest database",
-            "email_lifecycle": "Email / lifecycle marketing",
-            "in_stay_tools": "In-stay guest tools",
-            "housekeeping_maintenance": "Housekeeping & maintenance",
-            "finance_accounting": "Finance / accounting",
-            "reporting_bi": "Reporting / BI",
-        }
         qs.append("Please confirm the following stack items (vendor name, ownership property/group, and whether it is in use):")
         for k in missing:
-            qs.append(f"- {labels.get(k, k)}")
+            qs.append(f"- {CATEGORY_LABELS.get(k, k)}")
 
     if unknown_links:
         qs.append("Please confirm the following integrations (Active / Not active):")
@@ -113,29 +219,133 @@ def _build_minimum_followups(missing: List[str], unknown_links: List[Dict[str, s
     return qs
 
 
+def _report_cache_key(payload: Dict[str, Any]) -> bytes:
+    """Stable content hash of a validated intake payload (key order independent)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS))
+    return h.digest()
+
+
+def _cached_report(key: bytes, today: str) -> Optional[bytes]:
+    # Only reuse a body whose stamped report_date is still today's; a stale or differently-dated
+    # entry is treated as a miss and replaced by the rebuilt report
+    with _REPORT_CACHE_LOCK:
+        entry = _REPORT_CACHE.get(key)
+        if entry is None or entry[0] != today:
+            return None
+        _REPORT_CACHE.move_to_end(key)
+        return entry[1]
+
+
+def _store_report(key: bytes, report_date: str, body: bytes) -> None:
+    with _REPORT_CACHE_LOCK:
+        _REPORT_CACHE[key] = (report_date, body)
+        _REPORT_CACHE.move_to_end(key)
+        while len(_REPORT_CACHE) > _REPORT_CACHE_SIZE:
+            _REPORT_CACHE.popitem(last=False)
+
+
+def _openapi_schema(schema: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Split a JSON Schema file into an OpenAPI body schema and its component definitions.
+    Works on a copy: drops $schema/$id and points "#/$defs/<name>" refs at "#/components/schemas/<name>",
+    so the published spec resolves without the schema's made-up $id host.
+    """
+
+    def rewrite(node: Any) -> Any:
+        if isinstance(node, dict):
+            out = {k: rewrite(v) for k, v in node.items()}
+            ref = out.get("$ref")
+            if isinstance(ref, str) and ref.startswith("#/$defs/"):
+                out["$ref"] = "#/components/schemas/" + ref[len("#/$defs/"):]
+            return out
+        if isinstance(node, list):
+            return [rewrite(v) for v in node]
+        return node
+
+    body = rewrite(schema)
+    for key in ("$schema", "$id"):
+        body.pop(key, None)
+    return body, body.pop("$defs", {})
+
+
+_INTAKE_OPENAPI_SCHEMA, _INTAKE_OPENAPI_COMPONENTS = _openapi_schema(INTAKE_SCHEMA)
+_default_openapi = app.openapi
+
+
+def _openapi() -> Dict[str, Any]:
+    # FastAPI caches the generated spec on app.openapi_schema; register the intake $defs on first build
+    if app.openapi_schema is None:
+        spec = _default_openapi()
+        spec.setdefault("components", {}).setdefault("schemas", {}).update(_INTAKE_OPENAPI_COMPONENTS)
+    return app.openapi_schema
+
+
+app.openapi = _openapi
+
+
 @app.get("/health")
 def health() -> Dict[str, str]:
     return {"status": "ok"}
 
 
-@app.post("/v1/report")
-def generate_report(payload: Dict[str, Any]) -> JSONResponse:
+_VALIDATION_ERROR_DOC = (
+    'Schema validation failed. detail = {"schema": <name>, "errors": {<location>: <message>}}; '
+    'repeated locations are suffixed "#2", "#3", ... and a "(truncated)" key means more errors exist.'
+)
+
+
+@app.post(
+    "/v1/report",
+    # The body is read raw and parsed with jiter, so declare the intake schema for OpenAPI/docs explicitly
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": _INTAKE_OPENAPI_SCHEMA}}}},
+    responses={
+        422: {"description": f"Intake payload invalid. {_VALIDATION_ERROR_DOC}"},
+        500: {"description": f"Report output failed its self-check (HTS_VALIDATE_OUTPUT=1 only). {_VALIDATION_ERROR_DOC}"},
+    },
+)
+async def generate_report(request: Request) -> Response:
+    body = await request.body()
+    # Parsing, validation and the builders are CPU-bound; keep them off the event loop
+    return Response(await run_in_threadpool(_handle_report, body), status_code=200, media_type="application/json")
+
+
+def _handle_report(raw: bytes) -> bytes:
+    """Parse, validate and build (or fetch from cache) the serialized /v1/report response body."""
+    # 0) Parse body with jiter (single pass, repeated keys like "systems"/"evidence_level" cached)
+    try:
+        payload = jiter.from_json(raw, cache_mode="keys")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail={"schema": "stack_intake", "errors": {"(root)": f"Invalid JSON: {e}"}})
+
     # 1) Validate intake
-    intake_errors = _validate_with(INTAKE_VALIDATOR, payload)
+    intake_errors = _validate_with(INTAKE_VALIDATE, INTAKE_VALIDATOR, payload)
     if intake_errors:
         raise HTTPException(status_code=422, detail={"schema": "stack_intake", "errors": intake_errors})
 
-    # 2) Build stack register rows (complete, no unknown systems)
-    stack_rows = build_stack_register_rows(payload)
+    # Re-submitted payloads (retries, integration reruns) are served from the LRU
+    key = _report_cache_key(payload)
+    today = date.today().isoformat()
+    body = _cached_report(key, today)
+    if body is None:
+        content = _build_report(payload)
+        body = orjson.dumps(content)
+        # Record the date the builders actually stamped (blocked responses carry none)
+        report_date = content["report_json"]["meta"]["report_date"] if content["status"] == "ok" else today
+        _store_report(key, report_date, body)
+    return body
+
+
+def _build_report(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Steps 2-12 for a validated intake payload; returns the blocked or ok response content."""
+    # Normalize stack layout once; every downstream consumer sees {"systems": [...]}
+    evidence_index = _normalize_stack(payload)
 
     # Identify any categories still "not_provided"
-    missing_categories = []
-    for cat in _canonical_system_categories():
-        sys_block = _extract_system(payload, cat)
-        # If all entries are not_provided, treat as missing
-        all_not_provided = all(s.get("evidence_level") == "not_provided" for s in sys_block["systems"])
-        if all_not_provided:
-            missing_categories.append(cat)
+    missing_categories = _missing_categories(evidence_index)
+
+    # 2) Build stack register rows (complete, no unknown systems)
+    stack_rows = build_stack_register_rows(payload)
 
     # 3) Build integration map rows (unknown allowed but must be explicit)
     integration_rows, integration_unknowns = build_integration_map_rows(payload)
@@ -193,29 +403,27 @@ def generate_report(payload: Dict[str, Any]) -> JSONResponse:
         },
     }
 
-    # 10) Validate report output schema (machine-checkable)
-    out_errors = _validate_with(OUTPUT_VALIDATOR, report_json)
-    if out_errors:
-        raise HTTPException(status_code=500, detail={"schema": "report_output", "errors": out_errors})
+    # 10) Validate report output schema (machine-checkable; CI/debug only, see VALIDATE_OUTPUT)
+    if VALIDATE_OUTPUT:
+        out_errors = _validate_with(OUTPUT_VALIDATE, OUTPUT_VALIDATOR, report_json)
+        if out_errors:
+            raise HTTPException(status_code=500, detail={"schema": "report_output", "errors": out_errors})
 
     # 11) QA gating: if fails, block and ask minimal questions
     qa = run_qa_gates(report_json)
     if not qa["pass"]:
         followups = _build_minimum_followups(missing_categories, integration_unknowns)
-        return JSONResponse(
-            status_code=200,
-            content={
-                "status": "blocked",
-                "reason": "QA gates failed; additional confirmations required before an executive report can be issued.",
-                "qa": qa,
-                "confirmed_so_far": {
-                    "stack_register": stack_rows,
-                    "integration_map": integration_rows,
-                },
-                "questions_to_proceed": followups,
+        return {
+            "status": "blocked",
+            "reason": "QA gates failed; additional confirmations required before an executive report can be issued.",
+            "qa": qa,
+            "confirmed_so_far": {
+                "stack_register": stack_rows,
+                "integration_map": integration_rows,
             },
-        )
+            "questions_to_proceed": followups,
+        }
 
     # 12) Render markdown report (exec-safe) + return
     md = render_markdown_report(report_json, executive_summary=exec_summary)
-    return JSONResponse(status_code=200, content={"status": "ok", "report_json": report_json, "report_md": md})
+    return {"status": "ok", "report_json": report_json, "report_md": md}
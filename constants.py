@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from types import MappingProxyType
+from typing import Final, Mapping, Tuple
+
+
+# Mandatory stack categories, in register order (shared by every module; one tuple object)
+CATEGORIES: Final[Tuple[str, ...]] = (
+    "pms",
+    "booking_engine",
+    "channel_manager_crs",
+    "rms",
+    "crm_guest_db",
+    "email_lifecycle",
+    "in_stay_tools",
+    "housekeeping_maintenance",
+    "finance_accounting",
+    "reporting_bi",
+)
+
+# Executive-facing label per category
+CATEGORY_LABELS: Final[Mapping[str, str]] = MappingProxyType(
+    {
+        "pms": "PMS",
+        "booking_engine": "Booking engine",
+        "channel_manager_crs": "Channel manager / CRS",
+        "rms": "RMS",
+        "crm_guest_db": "CRM / guest database",
+        "email_lifecycle": "Email / lifecycle marketing",
+        "in_stay_tools": "In-stay guest tools",
+        "housekeeping_maintenance": "Housekeeping & maintenance",
+        "finance_accounting": "Finance / accounting",
+        "reporting_bi": "Reporting / BI",
+    }
+)
@@ -1,4 +1,8 @@
 from typing import Any, Dict, List, Tuple
+
+from constants import CATEGORY_LABELS
+
+
 def build_integration_map_rows(intake: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
     """
     Builds the canonical integration map from intake-confirmed statuses.
@@ -22,17 +26,7 @@ def build_integration_map_rows(intake: Dict[str, Any]) -> Tuple[List[Dict[str, A
     ]
 
     def label(cat: str) -> str:
-        names = {
-            "pms": "PMS",
-            "booking_engine": "Booking engine",
-            "channel_manager_crs": "Channel manager / CRS",
-            "rms": "RMS",
-            "crm_guest_db": "CRM / guest database",
-            "email_lifecycle": "Email / lifecycle marketing",
-            "finance_accounting": "Finance / accounting",
-            "reporting_bi": "Reporting / BI",
-        }
-        return names.get(cat, cat)
+        return CATEGORY_LABELS.get(cat, cat)
 
     # Build an index from intake['integrations'] if present
     # Keyed by (from, to)